@@ -1,96 +1,410 @@
 import streamlit as st
 import gspread
 import pandas as pd
+import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
 import requests
-from datetime import datetime, timedelta
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from gspread.http_client import BackOffHTTPClient
+from gspread.utils import a1_to_rowcol
+from functools import lru_cache
+from datetime import datetime
 from google_auth_oauthlib.flow import Flow # 使用官方 Google 套件
+from google.auth import jwt
 
 # --- Configuration ---
 SHEET_NAME = "MoodTrackerDB"
+REDIRECT_URI = "https://moodtracker-123.streamlit.app"
+OAUTH_SCOPES = ["openid", "https://www.googleapis.com/auth/userinfo.email"]
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+ID_TOKEN_CLOCK_SKEW = 60  # seconds; a server clock slightly behind Google's must not reject fresh tokens
+SHEET_COLUMNS = ("User_Email", "Date", "Score", "Tags", "Note", "Gratitude", "Medication")
+LAST_COLUMN = "G"  # Sheet column of SHEET_COLUMNS[-1]
+CATEGORY_COLUMNS = ("Tags", "User_Email", "Medication")
+# Note is write-only (never read back), so the frames skip the free-text column
+LOADED_COLUMNS = tuple(col for col in SHEET_COLUMNS if col != "Note")
+RECORDS_TTL = 300  # seconds
+SHEETS_TIMEOUT = 30  # seconds per Sheets request, so a hung call fails instead of blocking
+MAX_FETCH_RANGES = 100  # A1 ranges per batch_get call (they go in the GET URL)
+
+# Tags that usually raise (stressors) or lower (protective factors) the score
+NEGATIVE_TAGS = ("🩸 生理期/經前", "😴 沒睡好", "💊 忘記吃藥",
+                 "🤕 身體不舒服", "🤯 工作壓力", "👥 人際衝突",
+                 "🌧️ 天氣不好", "😰 莫名焦慮", "😶 無動力/空虛")
+POSITIVE_TAGS = ("🏃 有運動", "🎮 放鬆/娛樂", "🥰 與朋友聚會",
+                 "🎵 聽音樂", "🎨 創作/畫畫", "🚶 散步", "💤 睡眠充足",
+                 "🐾 陪伴寵物", "🧹 整理環境", "👔 準時出門")
+TAGS_LIST = NEGATIVE_TAGS + POSITIVE_TAGS
+
+# BSRS-5 answer scale: sliders return the int, the label is display only
+SCORE_LABELS = ("0: 完全沒有", "1: 輕微", "2: 中等", "3: 厲害", "4: 非常厲害")
+SCORE_OPTIONS = tuple(range(len(SCORE_LABELS)))
+
+DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Static page markup, built once at import instead of on every rerun
+HIDE_UI_CSS = """<style>
+    #MainMenu {visibility: hidden;} footer {visibility: hidden;} header {visibility: hidden;}
+    .stApp {padding-top: 20px;} 
+</style>"""
+LOGIN_BUTTON_TEMPLATE = '''
+    <a href="{auth_url}" target="_blank">
+        <button style="
+            background-color: white; color: #333; border: 1px solid #ccc; 
+            padding: 10px 20px; border-radius: 5px; cursor: pointer; font-size: 16px;
+            display: flex; align-items: center; gap: 10px;">
+            <img src="https://upload.wikimedia.org/wikipedia/commons/5/53/Google_%22G%22_Logo.svg" width="20"/>
+            Sign in with Google
+        </button>
+    </a>
+    <p style="font-size: 12px; color: grey; margin-top: 5px;">
+        (基於安全性考量，登入將會開啟新視窗)
+    </p>
+'''
 
 # --- 1. Database Connection ---
 @st.cache_resource
 def get_worksheet():
     try:
+        # BackOffHTTPClient retries 429 (per-minute quota) and 5xx with exponential backoff,
+        # so a burst of saves waits for the quota instead of failing
         if "gcp_service_account" in st.secrets:
             creds_dict = st.secrets["gcp_service_account"]
-            gc = gspread.service_account_from_dict(creds_dict)
+            gc = gspread.service_account_from_dict(creds_dict, http_client=BackOffHTTPClient)
         else:
-            gc = gspread.service_account(filename="credentials.json")
+            gc = gspread.service_account(filename="credentials.json", http_client=BackOffHTTPClient)
+        # gspread waits forever by default; a stuck append would never be reported
+        gc.set_timeout(SHEETS_TIMEOUT)
+        # open_by_key is a direct Sheets lookup; open() by title needs a Drive search
+        if "sheet_key" in st.secrets:
+            return gc.open_by_key(st.secrets["sheet_key"]).sheet1
         return gc.open(SHEET_NAME).sheet1
     except Exception as e:
         st.error(f"DB Connection Error: {e}")
         return None
 
+@st.cache_resource
+def get_oauth_config():
+    # Built once per process; the Flow itself stays per-run since it holds the login's token state
+    return {
+        "web": {
+            "client_id": st.secrets["oauth"]["client_id"],
+            "client_secret": st.secrets["oauth"]["client_secret"],
+            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }
+    }
+
+@st.cache_resource
+def get_http_session():
+    # Reuses the TCP+TLS connection to googleapis.com across cert refreshes
+    return requests.Session()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_google_certs():
+    # Google's ID token signing keys rotate over days, one fetch serves every login in the hour
+    response = get_http_session().get(GOOGLE_CERTS_URL, timeout=5)
+    # An error page must raise, not be cached as the certs for the next hour
+    response.raise_for_status()
+    return response.json()
+
+def fetch_user_email(credentials):
+    # The ID token from the token endpoint already carries the email claim, no userinfo call;
+    # it is checked locally against the cached certs
+    certs = fetch_google_certs()
+    if jwt.decode_header(credentials.id_token).get("kid") not in certs:
+        # Signed with a key newer than the cached certs
+        fetch_google_certs.clear()
+        certs = fetch_google_certs()
+    claims = jwt.decode(
+        credentials.id_token,
+        certs=certs,
+        audience=get_oauth_config()["web"]["client_id"],
+        clock_skew_in_seconds=ID_TOKEN_CLOCK_SKEW
+    )
+    if claims.get("iss") not in GOOGLE_ISSUERS:
+        raise ValueError(f"Unexpected ID token issuer: {claims.get('iss')}")
+    if not claims.get("email_verified"):
+        raise ValueError("Google account email is not verified")
+    return claims["email"]
+
+def build_records_df(values, sheet_rows=None):
+    # Raw list-of-lists from the sheet -> typed DataFrame (no per-row dict building)
+    if len(values) < 2:
+        return pd.DataFrame(columns=[col for col in values[0] if col in LOADED_COLUMNS] if values else None)
+    header = values[0]
+    keep = [i for i, col in enumerate(header) if col in LOADED_COLUMNS]
+    # batch_get trims trailing empty cells, so short rows read "" past their end
+    rows = [[row[i] if i < len(row) else "" for i in keep] for row in values[1:]]
+    df = pd.DataFrame(rows, columns=[header[i] for i in keep])
+    if sheet_rows is not None:
+        # Sheet row number of each record, the identity pending saves are reconciled on
+        df['Row'] = np.asarray(sheet_rows, dtype='int32')
+    # Type once here so every rerun gets parsed Date / numeric Score from the cache
+    df['Score'] = pd.to_numeric(df['Score'], downcast="unsigned")  # 0-20 fits in uint8
+    # Dates are always written as str(date) (RAW), so the fixed ISO format skips inference
+    df['Date'] = pd.to_datetime(df['Date'], format='%Y-%m-%d', cache=True)
+    # Days since 1970-01-01, so week buckets are integer math instead of datetime comparisons
+    df['DayNum'] = df['Date'].values.astype('datetime64[D]').astype('int32')
+    # Low-cardinality strings: category codes instead of one Python str per row
+    for col in CATEGORY_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype("category")
+    # Sort here so cache hits come back already in date order
+    return df.sort_values(by='Date')
+
+@st.cache_data(ttl=RECORDS_TTL, show_spinner=False)
+def fetch_user_rows(_sheet, user_email):
+    # Leading underscore: gspread worksheet is unhashable, only user_email is the cache key
+    # Scan just the email column, then pull the caller's rows (not every user's notes)
+    emails = _sheet.col_values(1)
+    rows = [i + 1 for i, email in enumerate(emails) if i > 0 and email == user_email]
+    if not rows:
+        records = build_records_df([])
+        records.attrs["fetched_at"] = time.monotonic()
+        return records
+
+    # Merge consecutive rows into one A1 range each to keep the request small
+    ranges, start = [], rows[0]
+    for prev, row in zip(rows, rows[1:] + [None]):
+        if row != prev + 1:
+            ranges.append(f"A{start}:{LAST_COLUMN}{prev}")
+            start = row
+    # batch_get is a GET, so a user whose rows are scattered across a long shared history
+    # is fetched in groups of ranges; the download stays proportional to their own rows
+    groups = [ranges[i:i + MAX_FETCH_RANGES] for i in range(0, len(ranges), MAX_FETCH_RANGES)]
+    blocks = _sheet.batch_get([f"A1:{LAST_COLUMN}1"] + groups[0])
+    for group in groups[1:]:
+        blocks += _sheet.batch_get(group)
+    user_rows = [row for block in blocks[1:] for row in block]
+    records = build_records_df([blocks[0][0]] + user_rows, sheet_rows=rows)
+    # Travels with the cached frame, so sessions know how old a cache hit really is
+    records.attrs["fetched_at"] = time.monotonic()
+    return records
+
+def merge_pending_rows(records, user_email):
+    # Rows saved this session show up right away, without a read-after-write
+    pending = st.session_state.get("pending_rows")
+    if not pending or pending["user"] != user_email: return records
+    # Writes that failed in the background are reported once and no longer shown
+    while pending["failed"]:
+        row, error = pending["failed"].pop()
+        pending["rows"].remove(row)
+        st.error(f"儲存失敗 ({row[1]}): {error}")
+    # A landed write is in the records once they hold its sheet row; matching on the row
+    # number rather than a row count keeps saves from other devices from retiring it early
+    if pending["landed"] and 'Row' in records:
+        fetched = set(records['Row'].tolist())
+        for row, sheet_row in [entry for entry in pending["landed"] if entry[1] in fetched]:
+            pending["landed"].remove((row, sheet_row))
+            pending["rows"].remove(row)
+    if not pending["rows"]:
+        del st.session_state.pending_rows
+        return records
+    new_df = build_records_df([list(SHEET_COLUMNS)] + pending["rows"])
+    new_df['Row'] = np.zeros(len(new_df), dtype='int32')  # not on the sheet yet as far as we know
+    # Same category set on both sides, otherwise concat falls back to object dtype
+    for col in CATEGORY_COLUMNS:
+        if col in records and col in new_df:
+            categories = records[col].cat.categories.union(new_df[col].cat.categories)
+            records[col] = records[col].cat.set_categories(categories)
+            new_df[col] = new_df[col].cat.set_categories(categories)
+    # ignore_index labels the new rows after the cached ones
+    return pd.concat([records, new_df], ignore_index=True)
+
+def get_write_executor():
+    # One worker per session: this session's appends reach the sheet in save order, and a
+    # slow write only holds up the saves queued behind it here, not other users'
+    if "write_executor" not in st.session_state:
+        st.session_state.write_executor = ThreadPoolExecutor(max_workers=1)
+    return st.session_state.write_executor
+
+def append_row_in_background(sheet, row, pending):
+    # The Sheets write runs off the script thread; the future is kept on the pending dict
+    # and reaped on a later rerun. table_range only pins Sheets' table detection to the
+    # table starting at A1, so stray cells beside it can't shift where the row lands
+    def write():
+        response = sheet.append_rows([row], value_input_option="RAW", table_range="A1")
+        # updatedRange looks like "Sheet1!A8:G8": the sheet row the entry landed on
+        return a1_to_rowcol(response["updates"]["updatedRange"].rsplit("!", 1)[-1].split(":")[0])[0]
+    pending["writes"].append((row, get_write_executor().submit(write)))
+
+def reap_pending_writes(pending):
+    # Finished writes move to landed (with their sheet row) or failed, for merge_pending_rows
+    running = []
+    for row, future in pending["writes"]:
+        if not future.done():
+            running.append((row, future))
+        elif future.exception() is not None:
+            pending["failed"].append((row, future.exception()))
+        else:
+            pending["landed"].append((row, future.result()))
+    pending["writes"] = running
+
+def save_pending_row(sheet, user_email, row):
+    # Keep the cached records and layer the new row on top until the cache refreshes
+    pending = st.session_state.get("pending_rows")
+    if not pending or pending["user"] != user_email:
+        pending = {"user": user_email, "rows": [], "writes": [], "landed": [], "failed": []}
+        st.session_state.pending_rows = pending
+    pending["rows"].append(row)
+    append_row_in_background(sheet, row, pending)
+
+def pending_key(user_email):
+    pending = st.session_state.get("pending_rows")
+    if not pending or pending["user"] != user_email: return (user_email, 0, 0, 0)
+    return (user_email, len(pending["rows"]), len(pending["landed"]), len(pending["failed"]))
+
+def load_user_frame(sheet, user_email):
+    # Plain reruns (widget changes, tab switches) reuse this session's built frame directly:
+    # no cache lookup, no unpickled copy, no merge/sort. Rebuilt when the records cache may
+    # have refreshed or when a save / finished background write changed the pending rows.
+    pending = st.session_state.get("pending_rows")
+    if pending: reap_pending_writes(pending)
+    cached = st.session_state.get("user_frame")
+    if cached and cached["key"] == pending_key(user_email) and time.monotonic() - cached["fetched_at"] < RECORDS_TTL:
+        return cached["df"]
+    records = fetch_user_rows(sheet, user_email)
+    # Expire on the age of the records, not of this rebuild: a rebuild after a write may
+    # have reused a cache entry that was already minutes old
+    fetched_at = records.attrs.get("fetched_at", time.monotonic())
+    df = analyze_user_data(merge_pending_rows(records, user_email))
+    # Keyed on the pending rows as the merge left them: it may have reported failures or
+    # retired the whole batch, and a new batch must not match the old batch's key
+    st.session_state.user_frame = {"key": pending_key(user_email), "fetched_at": fetched_at, "df": df}
+    return df
+
 # --- 2. Analytics Functions ---
-def analyze_user_data(df, user_email):
-    df = df[df['User_Email'] == user_email].copy()
+def analyze_user_data(df):
     if df.empty: return df
-    df['Date'] = pd.to_datetime(df['Date'])
+    # Cached records arrive sorted; only re-sort after pending rows were appended
+    if df['Date'].is_monotonic_increasing: return df
     return df.sort_values(by='Date')
 
-def get_tag_correlations(df):
-    # Filter out empty tags
-    tag_df = df[df['Tags'] != ""].copy()
-    
-    # Split tags by comma (since we stored them as "Tag1, Tag2")
-    tag_df['Tags'] = tag_df['Tags'].astype(str).str.split(', ')
-    
-    # Explode the list so each tag gets its own row
-    tag_df = tag_df.explode('Tags')
-    
-    if tag_df.empty: return pd.DataFrame()
-    
-    # Group by Tag and calculate average score and count
-    stats = tag_df.groupby('Tags')['Score'].agg(['mean', 'count']).reset_index()
-    
-    # Sort by average score (highest stress first)
-    return stats.sort_values(by='mean', ascending=False)
-
-def get_weekly_comparison(df):
+def get_weekly_comparison(df, now=None):
     if df.empty: return None, None
-    today = datetime.now()
-    curr_df = df[(df['Date'] > (today - timedelta(days=7))) & (df['Date'] <= today)]
-    last_df = df[(df['Date'] > (today - timedelta(days=14))) & (df['Date'] <= (today - timedelta(days=7)))]
-    return curr_df['Score'].mean(), last_df['Score'].mean()
+    # Bucket rows by whole weeks back from today (0 = last 7 days incl. today, 1 = the 7 before)
+    # and reduce every bucket in one bincount pass
+    now = pd.Timestamp.now() if now is None else now
+    today = np.datetime64(now.normalize(), 'D').astype('int32')
+    # df is date-sorted, so the 14 days of interest are one slice found by binary search;
+    # only that slice is touched instead of masking the whole history
+    day_nums = df['DayNum'].to_numpy()
+    lo = np.searchsorted(day_nums, today - 13, side='left')
+    hi = np.searchsorted(day_nums, today, side='right')
+    buckets = (today - day_nums[lo:hi]) // 7
+    sums = np.bincount(buckets, weights=df['Score'].to_numpy()[lo:hi], minlength=2)
+    counts = np.bincount(buckets, minlength=2)
+    means = np.full(2, np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+    return means[0], means[1]
+
+@lru_cache(maxsize=4096)
+def split_tags(tags):
+    # Tags are stored as "Tag1, Tag2"; each distinct string is parsed once per process
+    return tuple(tags.split(', ')) if tags else ()
+
+def tag_stats_frame(sums, counts):
+    if not counts: return pd.DataFrame()
+    stats = pd.DataFrame({
+        'Tags': list(counts),
+        'mean': [sums[tag] / counts[tag] for tag in counts],
+        'count': list(counts.values()),
+    })
+    return stats.sort_values(by='mean', ascending=False)
 
 def get_tag_correlations(df):
-    tag_df = df[df['Tags'] != ""].copy()
-    tag_df['Tags'] = tag_df['Tags'].astype(str).str.split(', ')
-    tag_df = tag_df.explode('Tags')
-    if tag_df.empty: return pd.DataFrame()
-    return tag_df.groupby('Tags')['Score'].agg(['mean', 'count']).reset_index().sort_values(by='mean', ascending=False)
+    # Pass 1: sum/count scores per distinct Tags string via the category codes (numpy, no strings)
+    tags = df['Tags'].astype("category")
+    codes = tags.cat.codes.to_numpy()
+    valid = codes >= 0
+    n_combos = len(tags.cat.categories)
+    combo_sums = np.bincount(codes[valid], weights=df['Score'].to_numpy()[valid], minlength=n_combos)
+    combo_counts = np.bincount(codes[valid], minlength=n_combos)
+    # Pass 2: split each distinct combination once, weighted by how often it occurred
+    sums, counts = defaultdict(float), defaultdict(int)
+    for combo, combo_sum, combo_count in zip(tags.cat.categories, combo_sums.tolist(), combo_counts.tolist()):
+        if not combo_count: continue
+        for tag in split_tags(str(combo)):
+            sums[tag] += combo_sum
+            counts[tag] += combo_count
+    return tag_stats_frame(sums, counts)
+
+def get_cached_tag_stats(df):
+    """Tag stats kept with this session's built frame, so they are redone exactly when load_user_frame rebuilds it"""
+    frame = st.session_state.get("user_frame")
+    if frame is None or frame["df"] is not df: return get_tag_correlations(df)
+    if "tag_stats" not in frame:
+        frame["tag_stats"] = get_tag_correlations(df)
+    return frame["tag_stats"]
+
+# Pure functions of the user's frame: Streamlit's default content hash of a per-user frame is
+# exact, so cached results can never leak across users or go stale after a save
+@st.cache_data(ttl=3600, show_spinner=False)
+def compute_insight_stats(df, now=None):
+    """Reductions shared by the Insights sections, taken in one go over the user's arrays"""
+    scores = df['Score'].to_numpy(dtype=float)
+    # Weekday straight from the day number (1970-01-01 was a Thursday, Monday = 0)
+    dow = (df['DayNum'].to_numpy() + 3) % 7
+    stats = {
+        'overall_mean': scores.mean() if len(scores) else np.nan,
+        'day_sums': np.bincount(dow, weights=scores, minlength=7),
+        'day_counts': np.bincount(dow, minlength=7),
+    }
+
+    if 'Medication' in df.columns:
+        # Last 30 days, N/A entries (no regular medication) excluded
+        now = pd.Timestamp.now() if now is None else now
+        recent = df['Date'].to_numpy() > (now - pd.Timedelta(days=30)).to_datetime64()
+        # Categorical equality compares the int8 codes
+        med = df['Medication']
+        taken = recent & (med == 'Yes').to_numpy()
+        missed = recent & (med == 'No').to_numpy()
+        stats.update({
+            'med_total': int((recent & (med != 'N/A').to_numpy()).sum()),
+            'med_yes_count': int(taken.sum()),
+            'med_yes_sum': scores[taken].sum(),
+            'med_no_count': int(missed.sum()),
+            'med_no_sum': scores[missed].sum(),
+        })
+    return stats
 
-def get_pattern_insights(df):
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_pattern_insights(df, tag_stats=None, stats=None):
     """Generate smart insights based on user's mood patterns"""
     insights = []
 
     if df.empty or len(df) < 7:
         return insights
 
-    # Add day of week column
-    df_copy = df.copy()
-    df_copy['DayOfWeek'] = df_copy['Date'].dt.dayofweek
-    df_copy['DayName'] = df_copy['Date'].dt.day_name()
+    # df comes from analyze_user_data, already in date order: "most recent N" is a tail slice
+    scores = df['Score'].to_numpy(dtype=float)
 
-    # 1. Day of week patterns
-    day_stats = df_copy.groupby('DayName')['Score'].agg(['mean', 'count']).reset_index()
-    if len(day_stats) >= 3:  # Need at least 3 different days
-        best_day = day_stats.loc[day_stats['mean'].idxmin()]
-        worst_day = day_stats.loc[day_stats['mean'].idxmax()]
+    # 1. Day of week patterns from the shared per-weekday sums/counts
+    if stats is None:
+        stats = compute_insight_stats(df)
+    day_counts, day_sums = stats['day_counts'], stats['day_sums']
+    seen_days = np.flatnonzero(day_counts)
+    if len(seen_days) >= 3:  # Need at least 3 different days
+        day_means = day_sums[seen_days] / day_counts[seen_days]
+        best_day, worst_day = seen_days[day_means.argmin()], seen_days[day_means.argmax()]
+        best_mean, worst_mean = day_means.min(), day_means.max()
 
-        if worst_day['mean'] - best_day['mean'] >= 2:
+        if worst_mean - best_mean >= 2:
             insights.append({
                 'type': 'day_pattern',
                 'icon': '📅',
-                'text': f"你在 **{worst_day['DayName']}** 時分數通常較高 (平均 {worst_day['mean']:.1f})，而 **{best_day['DayName']}** 時較低 (平均 {best_day['mean']:.1f})。"
+                'text': f"你在 **{DAY_NAMES[worst_day]}** 時分數通常較高 (平均 {worst_mean:.1f})，而 **{DAY_NAMES[best_day]}** 時較低 (平均 {best_mean:.1f})。"
             })
 
     # 2. Recent trend (last 7 days vs previous 7 days)
-    if len(df_copy) >= 14:
-        recent_7 = df_copy.nlargest(7, 'Date')['Score'].mean()
-        prev_7 = df_copy.nlargest(14, 'Date').nsmallest(7, 'Date')['Score'].mean()
+    if len(scores) >= 14:
+        recent_7 = scores[-7:].mean()
+        prev_7 = scores[-14:-7].mean()
         diff = recent_7 - prev_7
 
         if abs(diff) >= 2:
@@ -108,25 +422,21 @@ def get_pattern_insights(df):
                 })
 
     # 3. Consecutive high scores warning
-    recent_5 = df_copy.nlargest(5, 'Date').sort_values('Date')
-    if len(recent_5) == 5 and recent_5['Score'].mean() >= 12:
+    recent_5 = scores[-5:].mean()
+    if recent_5 >= 12:
         insights.append({
             'type': 'warning',
             'icon': '⚠️',
-            'text': f"你最近 5 次記錄的平均分數為 {recent_5['Score'].mean():.1f}（中高程度）。如果持續感到困擾，建議尋求專業協助。"
+            'text': f"你最近 5 次記錄的平均分數為 {recent_5:.1f}（中高程度）。如果持續感到困擾，建議尋求專業協助。"
         })
 
     # 4. Tag-based insights (if tags exist)
-    if 'Tags' in df_copy.columns:
-        tag_stats = get_tag_correlations(df_copy)
+    if 'Tags' in df.columns:
+        if tag_stats is None:
+            tag_stats = get_tag_correlations(df)
         if not tag_stats.empty and len(tag_stats) >= 2:
-            # Define positive tags (protective factors)
-            positive_tags = ["🏃 有運動", "🎮 放鬆/娛樂", "🥰 與朋友聚會",
-                           "🎵 聽音樂", "🎨 創作/畫畫", "🚶 散步", "💤 睡眠充足",
-                           "🐾 陪伴寵物", "🧹 整理環境", "👔 準時出門"]
-
             # Find most helpful positive tag
-            positive_tag_stats = tag_stats[tag_stats['Tags'].isin(positive_tags)]
+            positive_tag_stats = tag_stats[tag_stats['Tags'].isin(POSITIVE_TAGS)]
             if not positive_tag_stats.empty:
                 best_tag = positive_tag_stats.iloc[-1]  # Last one (lowest mean score among positive tags)
                 if best_tag['count'] >= 3:  # Need at least 3 occurrences
@@ -138,37 +448,64 @@ def get_pattern_insights(df):
 
     return insights
 
+@st.cache_data(show_spinner=False)
+def build_trend_fig(dates, scores):
+    # Tuples hash cheaply, so reruns with unchanged data reuse the built figure;
+    # Scattergl renders through WebGL and skips plotly express' DataFrame introspection
+    fig = go.Figure(go.Scattergl(x=dates, y=scores, mode='lines+markers'))
+    fig.update_layout(title="Mood Score Over Time", xaxis_title="Date", yaxis_title="Score", yaxis_range=[0, 21])
+    return fig
+
+@st.cache_data(show_spinner=False)
+def build_dow_fig(days, means):
+    fig = px.bar(
+        x=days,
+        y=means,
+        labels={'x': 'Day of Week', 'y': 'Avg Score'},
+        title="Average Score by Day of Week",
+        color=means,
+        color_continuous_scale="RdYlGn_r"
+    )
+    fig.update_layout(showlegend=False)
+    return fig
+
+@st.cache_data(show_spinner=False)
+def build_tag_bar_fig(tags, means, colorscale, category_order):
+    fig = go.Figure(go.Bar(
+        x=means,
+        y=tags,
+        orientation='h',
+        text=means,
+        texttemplate='%{text:.1f}',
+        textposition='outside',
+        marker={'color': means, 'colorscale': colorscale}
+    ))
+    fig.update_layout(
+        xaxis_title="Avg Score",
+        yaxis={'categoryorder': category_order},
+        showlegend=False,
+        height=max(200, len(tags) * 40)
+    )
+    return fig
+
 # --- 3. Main Application ---
 def main():
     st.set_page_config(page_title="Mood Tracker", page_icon="🧠", layout="centered")
     
     # Hide Streamlit UI
-    st.markdown("""<style>
-        #MainMenu {visibility: hidden;} footer {visibility: hidden;} header {visibility: hidden;}
-        .stApp {padding-top: 20px;} 
-    </style>""", unsafe_allow_html=True)
+    st.markdown(HIDE_UI_CSS, unsafe_allow_html=True)
 
     st.title("🌱 Mood Tracker")
 
     # --- 🛠️ MANUAL AUTH FLOW (The Robust Way) ---
     if "user_email" not in st.session_state:
         
-        client_config = {
-            "web": {
-                "client_id": st.secrets["oauth"]["client_id"],
-                "client_secret": st.secrets["oauth"]["client_secret"],
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-            }
-        }
-        
-        redirect_uri = "https://moodtracker-123.streamlit.app"
-
+        client_config = get_oauth_config()
 
         flow = Flow.from_client_config(
             client_config,
-            scopes=["openid", "https://www.googleapis.com/auth/userinfo.email"],
-            redirect_uri=redirect_uri
+            scopes=OAUTH_SCOPES,
+            redirect_uri=REDIRECT_URI
         )
 
         if "code" in st.query_params:
@@ -178,11 +515,7 @@ def main():
                 flow.fetch_token(code=code)
                 credentials = flow.credentials
 
-                user_info_service = requests.get(
-                    "https://www.googleapis.com/oauth2/v1/userinfo",
-                    headers={"Authorization": f"Bearer {credentials.token}"}
-                )
-                user_email = user_info_service.json().get("email")
+                user_email = fetch_user_email(credentials)
                 
                 st.session_state.user_email = user_email
                 
@@ -195,20 +528,7 @@ def main():
 
         else:
             auth_url, _ = flow.authorization_url(prompt='consent')
-            st.markdown(f'''
-                <a href="{auth_url}" target="_blank">
-                    <button style="
-                        background-color: white; color: #333; border: 1px solid #ccc; 
-                        padding: 10px 20px; border-radius: 5px; cursor: pointer; font-size: 16px;
-                        display: flex; align-items: center; gap: 10px;">
-                        <img src="https://upload.wikimedia.org/wikipedia/commons/5/53/Google_%22G%22_Logo.svg" width="20"/>
-                        Sign in with Google
-                    </button>
-                </a>
-                <p style="font-size: 12px; color: grey; margin-top: 5px;">
-                    (基於安全性考量，登入將會開啟新視窗)
-                </p>
-                ''', unsafe_allow_html=True)
+            st.markdown(LOGIN_BUTTON_TEMPLATE.format(auth_url=auth_url), unsafe_allow_html=True)
             st.info("🔒 Please log in to access your private journal.")
             st.stop()
 
@@ -220,12 +540,18 @@ def main():
     with col2:
         if st.button("Logout"):
             del st.session_state.user_email
+            st.session_state.pop("last_score", None)
             st.rerun()
 
     # --- APP LOGIC STARTS HERE ---
     sheet = get_worksheet()
     if not sheet: st.stop()
 
+    # Build the user's frame once per rerun, both tabs read it
+    df = load_user_frame(sheet, user_email)
+    # One "today" per rerun, shared by every date window below (entries are whole days)
+    today = pd.Timestamp.now().normalize()
+
     tab1, tab2 = st.tabs(["📝 Check-in", "📊 Insights"])
 
     with tab1:
@@ -276,64 +602,44 @@ def main():
 
         st.divider()
 
-        opts_map = {
-            "0: 完全沒有": 0,
-            "1: 輕微": 1,
-            "2: 中等": 2,
-            "3: 厲害": 3,
-            "4: 非常厲害": 4
-        }
-        opts = list(opts_map.keys())
-        
-        st.markdown("##### 1. 睡眠困難 (難入睡/易醒/早醒)")
-        q1 = st.select_slider("Sleep", opts, label_visibility="collapsed")
-        
-        st.markdown("##### 2. 感覺緊張不安")
-        q2 = st.select_slider("Tense", opts, label_visibility="collapsed")
-        
-        st.markdown("##### 3. 覺得容易苦惱或動怒")
-        q3 = st.select_slider("Irritated", opts, label_visibility="collapsed")
-        
-        st.markdown("##### 4. 感覺憂鬱、心情低落")
-        q4 = st.select_slider("Blue", opts, label_visibility="collapsed")
-        
-        st.markdown("##### 5. 覺得比不上別人")
-        q5 = st.select_slider("Inferior", opts, label_visibility="collapsed")
-        
-        score = sum([opts_map[q] for q in [q1, q2, q3, q4, q5]])
-        
-        if score < 6:
-            st.success(f"😊 當前總分：{score} / 20 (狀況不錯)")
-        elif score < 10:
-            st.info(f"😐 當前總分：{score} / 20 (輕度困擾)")
-        elif score < 15:
-            st.warning(f"😟 當前總分：{score} / 20 (中度困擾)")
-        else:
-            st.error(f"🚨 當前總分：{score} / 20 (嚴重困擾，請多保重)")
-
-        st.divider()
-        
-        tags = st.multiselect("影響心情的因素 (Tags)",
-            ["🩸 生理期/經前", "😴 沒睡好", "💊 忘記吃藥",
-                "🤕 身體不舒服", "🤯 工作壓力", "👥 人際衝突",
-                "🌧️ 天氣不好", "😰 莫名焦慮", "😶 無動力/空虛",
-                "🏃 有運動", "🎮 放鬆/娛樂", "🥰 與朋友聚會",
-                "🎵 聽音樂", "🎨 創作/畫畫", "🚶 散步", "💤 睡眠充足",
-                "🐾 陪伴寵物", "🧹 整理環境", "👔 準時出門"])
-        
-        note = st.text_area("一句話日記 (Note)", placeholder="今天發生了什麼小事？")
-
-        st.divider()
-
-        # Gratitude & Positive Psychology Section
-        st.markdown("##### 🌟 今日感恩 & 小確幸 (Gratitude & Wins)")
-        st.caption("記錄正向的事物能幫助平衡負面情緒 - 研究證實對憂鬱症有幫助")
-
-        gratitude_1 = st.text_input("1. 今天感謝的一件事", placeholder="例：朋友的一句關心、好吃的一餐、陽光...")
-        gratitude_2 = st.text_input("2. 今天做得不錯的事（再小都可以）", placeholder="例：起床了、洗澡了、回了訊息、出門買東西...")
-        gratitude_3 = st.text_input("3. 今天讓你微笑的瞬間（可選）", placeholder="例：看到可愛的貓、聽到喜歡的歌...", key="gratitude_3")
-
-        if st.button("💾 儲存紀錄 (Save Entry)", type="primary", use_container_width=True):
+        # Widgets inside a form don't rerun the script; only the submit button does
+        with st.form("checkin"):
+            st.markdown("##### 1. 睡眠困難 (難入睡/易醒/早醒)")
+            q1 = st.select_slider("Sleep", SCORE_OPTIONS, format_func=SCORE_LABELS.__getitem__, label_visibility="collapsed")
+            
+            st.markdown("##### 2. 感覺緊張不安")
+            q2 = st.select_slider("Tense", SCORE_OPTIONS, format_func=SCORE_LABELS.__getitem__, label_visibility="collapsed")
+            
+            st.markdown("##### 3. 覺得容易苦惱或動怒")
+            q3 = st.select_slider("Irritated", SCORE_OPTIONS, format_func=SCORE_LABELS.__getitem__, label_visibility="collapsed")
+            
+            st.markdown("##### 4. 感覺憂鬱、心情低落")
+            q4 = st.select_slider("Blue", SCORE_OPTIONS, format_func=SCORE_LABELS.__getitem__, label_visibility="collapsed")
+            
+            st.markdown("##### 5. 覺得比不上別人")
+            q5 = st.select_slider("Inferior", SCORE_OPTIONS, format_func=SCORE_LABELS.__getitem__, label_visibility="collapsed")
+            
+            score = q1 + q2 + q3 + q4 + q5
+
+            st.divider()
+            
+            tags = st.multiselect("影響心情的因素 (Tags)", TAGS_LIST)
+            
+            note = st.text_area("一句話日記 (Note)", placeholder="今天發生了什麼小事？")
+
+            st.divider()
+
+            # Gratitude & Positive Psychology Section
+            st.markdown("##### 🌟 今日感恩 & 小確幸 (Gratitude & Wins)")
+            st.caption("記錄正向的事物能幫助平衡負面情緒 - 研究證實對憂鬱症有幫助")
+
+            gratitude_1 = st.text_input("1. 今天感謝的一件事", placeholder="例：朋友的一句關心、好吃的一餐、陽光...")
+            gratitude_2 = st.text_input("2. 今天做得不錯的事（再小都可以）", placeholder="例：起床了、洗澡了、回了訊息、出門買東西...")
+            gratitude_3 = st.text_input("3. 今天讓你微笑的瞬間（可選）", placeholder="例：看到可愛的貓、聽到喜歡的歌...", key="gratitude_3")
+
+            submitted = st.form_submit_button("💾 儲存紀錄 (Save Entry)", type="primary", use_container_width=True)
+
+        if submitted:
             if not user_email:
                 st.error("請先登入")
             else:
@@ -344,271 +650,237 @@ def main():
                     med_status = "N/A"
                 else:
                     med_status = "Yes" if med_taken else "No"
-                sheet.append_row([user_email, str(date_val), score, ", ".join(tags), note, gratitude_entries, med_status])
+                row = [user_email, str(date_val), score, ", ".join(tags), note, gratitude_entries, med_status]
+                save_pending_row(sheet, user_email, row)
+                st.session_state.last_score = (user_email, score)
                 st.toast("✅ 紀錄已儲存！", icon="🎉")
-                st.cache_data.clear()
-                import time
                 time.sleep(1)
                 st.rerun()
 
+        # Sliders inside the form don't rerun, so the score feedback follows the last saved entry;
+        # shown once on the rerun after the save, and only to the user who saved it
+        saved = st.session_state.pop("last_score", None)
+        if saved and saved[0] == user_email:
+            last_score = saved[1]
+            if last_score < 6:
+                st.success(f"😊 剛儲存的總分：{last_score} / 20 (狀況不錯)")
+            elif last_score < 10:
+                st.info(f"😐 剛儲存的總分：{last_score} / 20 (輕度困擾)")
+            elif last_score < 15:
+                st.warning(f"😟 剛儲存的總分：{last_score} / 20 (中度困擾)")
+            else:
+                st.error(f"🚨 剛儲存的總分：{last_score} / 20 (嚴重困擾，請多保重)")
+
         # Instant Stats
-        raw = sheet.get_all_records()
-        if raw:
-            df = analyze_user_data(pd.DataFrame(raw), user_email)
-            if not df.empty:
-                curr, last = get_weekly_comparison(df)
-                if curr is not None and last is not None:
-                    delta = curr - last
-                    st.divider()
-                    st.metric("Week Avg", f"{curr:.1f}", f"{delta:.1f}", delta_color="inverse")
+        # A week-over-week comparison needs at least two entries
+        if len(df) >= 2:
+            curr, last = get_weekly_comparison(df, now=today)
+            if curr is not None and last is not None:
+                delta = curr - last
+                st.divider()
+                st.metric("Week Avg", f"{curr:.1f}", f"{delta:.1f}", delta_color="inverse")
 
     with tab2:
-        if raw:
-            # Convert raw data to DataFrame
-            df = analyze_user_data(pd.DataFrame(raw), user_email)
-
-            if not df.empty:
-                # 0. Smart Pattern Insights (NEW!)
-                st.subheader("🧠 智能洞察 (Pattern Insights)")
-                st.caption("基於你的紀錄自動分析出的模式")
-
-                insights = get_pattern_insights(df)
-
-                if insights:
-                    for insight in insights:
-                        if insight['type'] == 'warning':
-                            st.warning(f"{insight['icon']} {insight['text']}")
-                        elif insight['type'] == 'trend' and '降低' in insight['text']:
-                            st.success(f"{insight['icon']} {insight['text']}")
-                        else:
-                            st.info(f"{insight['icon']} {insight['text']}")
-                else:
-                    st.info("繼續記錄幾天後，這裡會顯示個人化的洞察分析！")
+        if not df.empty:
+            # 0. Smart Pattern Insights (NEW!)
+            st.subheader("🧠 智能洞察 (Pattern Insights)")
+            st.caption("基於你的紀錄自動分析出的模式")
+
+            # Tag stats feed both the insights and the tag section below, compute once
+            tag_stats = get_cached_tag_stats(df)
+            # Day-granular "now" keeps the 30-day window stable (and cacheable) within a day
+            stats = compute_insight_stats(df, now=today)
+            insights = get_pattern_insights(df, tag_stats=tag_stats, stats=stats)
+
+            if insights:
+                for insight in insights:
+                    if insight['type'] == 'warning':
+                        st.warning(f"{insight['icon']} {insight['text']}")
+                    elif insight['type'] == 'trend' and '降低' in insight['text']:
+                        st.success(f"{insight['icon']} {insight['text']}")
+                    else:
+                        st.info(f"{insight['icon']} {insight['text']}")
+            else:
+                st.info("繼續記錄幾天後，這裡會顯示個人化的洞察分析！")
 
-                st.divider()
+            st.divider()
 
-                # 1. Trend Chart (Existing)
-                st.subheader("📈 Mood Trend")
-                fig_trend = px.line(df, x="Date", y="Score", markers=True, title="Mood Score Over Time")
-                fig_trend.update_layout(yaxis_range=[0, 21])
+            # 1. Trend Chart (Existing)
+            st.subheader("📈 Mood Trend")
+            if len(df) < 2:
+                st.info("再多記錄幾天，就能看到心情趨勢圖！")
+            else:
+                fig_trend = build_trend_fig(tuple(df['Date']), tuple(df['Score']))
                 st.plotly_chart(fig_trend, use_container_width=True)
 
-                # Day of Week Pattern (if enough data)
-                if len(df) >= 7:
-                    df_temp = df.copy()
-                    df_temp['DayOfWeek'] = df_temp['Date'].dt.day_name()
-                    # Order days correctly
-                    day_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-                    day_stats = df_temp.groupby('DayOfWeek')['Score'].mean().reindex(day_order).dropna()
-
-                    if len(day_stats) >= 3:
-                        with st.expander("📅 查看星期分布"):
-                            fig_dow = px.bar(
-                                x=day_stats.index,
-                                y=day_stats.values,
-                                labels={'x': 'Day of Week', 'y': 'Avg Score'},
-                                title="Average Score by Day of Week",
-                                color=day_stats.values,
-                                color_continuous_scale="RdYlGn_r"
-                            )
-                            fig_dow.update_layout(showlegend=False)
-                            st.plotly_chart(fig_dow, use_container_width=True)
-
-                st.divider()
+            # Day of Week Pattern (if enough data)
+            if len(df) >= 7:
+                # Weekdays in Monday-first order, only the ones that have entries
+                seen_days = np.flatnonzero(stats['day_counts'])
+                day_means = stats['day_sums'][seen_days] / stats['day_counts'][seen_days]
 
-                # 2. Tag Correlation Analysis - Enhanced with Protective Factors
-                st.subheader("🔍 What affects your mood?")
-
-                # Calculate stats
-                tag_stats = get_tag_correlations(df)
-
-                if not tag_stats.empty:
-                    # Define which tags are inherently positive (protective) vs negative (stressors)
-                    positive_tags = ["🏃 有運動", "🎮 放鬆/娛樂", "🥰 與朋友聚會",
-                                   "🎵 聽音樂", "🎨 創作/畫畫", "🚶 散步", "💤 睡眠充足",
-                                   "🐾 陪伴寵物", "🧹 整理環境", "👔 準時出門"]
-                    negative_tags = ["🩸 生理期/經前", "😴 沒睡好", "💊 忘記吃藥",
-                                   "🤕 身體不舒服", "🤯 工作壓力", "👥 人際衝突",
-                                   "🌧️ 天氣不好", "😰 莫名焦慮", "😶 無動力/空虛"]
-
-                    # Calculate overall average score for comparison
-                    overall_avg = df['Score'].mean()
-
-                    # Separate based on tag category AND score comparison
-                    stressors = tag_stats[tag_stats['Tags'].isin(negative_tags)].sort_values(by='mean', ascending=False)
-                    protective = tag_stats[tag_stats['Tags'].isin(positive_tags)].sort_values(by='mean', ascending=True)
-
-                    # Display insights
-                    col_stress, col_protect = st.columns(2)
-
-                    with col_stress:
-                        st.metric("Overall Avg Score", f"{overall_avg:.1f}", help="Your average mood score across all entries")
-
-                    with col_protect:
-                        if not protective.empty:
-                            best_factor = protective.iloc[0]['Tags']
-                            best_score = protective.iloc[0]['mean']
-                            improvement = overall_avg - best_score
-                            st.metric("Best Helper", f"{best_factor}", f"-{improvement:.1f}", delta_color="inverse", help="Tag with lowest avg score")
-
-                    # Show stressors
-                    if not stressors.empty:
-                        st.markdown("#### ⚠️ 壓力因素 (Stressors)")
-                        st.caption(f"這些標籤出現時，你的分數通常較高（平均 > {overall_avg:.1f}）")
-
-                        fig_stress = px.bar(
-                            stressors,
-                            x="mean",
-                            y="Tags",
-                            orientation='h',
-                            labels={"mean": "Avg Score", "Tags": ""},
-                            text="mean",
-                            color="mean",
-                            color_continuous_scale="Reds"
-                        )
-                        fig_stress.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                        fig_stress.update_layout(
-                            yaxis={'categoryorder':'total ascending'},
-                            showlegend=False,
-                            height=max(200, len(stressors) * 40)
-                        )
-                        st.plotly_chart(fig_stress, use_container_width=True)
-
-                    # Show protective factors
-                    if not protective.empty:
-                        st.markdown("#### 💚 保護因素 (Protective Factors)")
-                        st.caption(f"這些標籤出現時，你的分數通常較低（平均 ≤ {overall_avg:.1f}）")
-
-                        fig_protect = px.bar(
-                            protective,
-                            x="mean",
-                            y="Tags",
-                            orientation='h',
-                            labels={"mean": "Avg Score", "Tags": ""},
-                            text="mean",
-                            color="mean",
-                            color_continuous_scale="Greens_r"  # Reverse so darker = better
-                        )
-                        fig_protect.update_traces(texttemplate='%{text:.1f}', textposition='outside')
-                        fig_protect.update_layout(
-                            yaxis={'categoryorder':'total descending'},
-                            showlegend=False,
-                            height=max(200, len(protective) * 40)
-                        )
-                        st.plotly_chart(fig_protect, use_container_width=True)
-
-                        # Actionable insight
-                        st.success(f"💡 **洞察**: 試著增加「{protective.iloc[0]['Tags']}」的頻率，這通常能幫助你感覺更好！")
-
-                    # Show detail table (optional)
-                    with st.expander("See detailed statistics"):
-                        st.dataframe(tag_stats.rename(columns={"mean": "Avg Score", "count": "Frequency"}), use_container_width=True)
-                else:
-                    st.info("No tags recorded yet. Try adding tags to your entries!")
-
-                st.divider()
-
-                # 3. Medication Adherence Analysis - Only show if user takes medication
-                # Check session state to see if user takes medication
-                if st.session_state.get("takes_medication", False):
-                    st.subheader("💊 用藥順從性分析 (Medication Adherence)")
-
-                    # Check if Medication column exists
-                    if 'Medication' in df.columns:
-                        # Filter last 30 days and exclude N/A entries
-                        med_df = df[df['Date'] > (datetime.now() - timedelta(days=30))].copy()
-                        med_df = med_df[med_df['Medication'] != 'N/A']
-
-                        if not med_df.empty:
-                            # Calculate adherence rate
-                            total_days = len(med_df)
-                            days_taken = len(med_df[med_df['Medication'] == 'Yes'])
-                            adherence_rate = (days_taken / total_days * 100) if total_days > 0 else 0
-
-                            # Display metrics
-                            col1, col2, col3 = st.columns(3)
-                            with col1:
-                                st.metric("30天服藥率", f"{adherence_rate:.0f}%")
-                            with col2:
-                                st.metric("已服藥天數", f"{days_taken}/{total_days}")
-                            with col3:
-                                missed_days = total_days - days_taken
-                                st.metric("漏服天數", f"{missed_days}")
-
-                            # Adherence color coding
-                            if adherence_rate >= 80:
-                                st.success("✅ 服藥順從性良好！持續保持。")
-                            elif adherence_rate >= 50:
-                                st.warning("⚠️ 服藥順從性中等。試著設定提醒來提高服藥率。")
-                            else:
-                                st.error("🚨 服藥順從性偏低。建議與醫師討論是否需要調整用藥計畫。")
-
-                            # Correlation: Medication vs Mood Score
-                            if len(med_df[med_df['Medication'] == 'Yes']) > 0 and len(med_df[med_df['Medication'] == 'No']) > 0:
-                                avg_score_taken = med_df[med_df['Medication'] == 'Yes']['Score'].mean()
-                                avg_score_missed = med_df[med_df['Medication'] == 'No']['Score'].mean()
-                                score_diff = avg_score_missed - avg_score_taken
-
-                                st.markdown("#### 用藥對情緒的影響")
-                                col_a, col_b = st.columns(2)
-                                with col_a:
-                                    st.metric("有服藥時平均分數", f"{avg_score_taken:.1f}")
-                                with col_b:
-                                    st.metric("漏服藥時平均分數", f"{avg_score_missed:.1f}", f"+{score_diff:.1f}" if score_diff > 0 else f"{score_diff:.1f}")
-
-                                if score_diff > 1:
-                                    st.info(f"💡 **洞察**: 漏服藥時，你的分數平均高 {score_diff:.1f} 分。規律服藥似乎對你的情緒有幫助。")
-                                elif score_diff < -1:
-                                    st.info(f"💡 **洞察**: 有服藥時，你的分數平均高 {abs(score_diff):.1f} 分。建議與醫師討論藥物是否適合。")
-                                else:
-                                    st.info("💡 用藥與情緒分數的關聯性不明顯，可能需要更多數據來分析。")
-                        else:
-                            st.info("最近 30 天沒有用藥紀錄。")
-                    else:
-                        st.info("用藥追蹤功能已新增！下次記錄時就可以使用了。")
+                if len(seen_days) >= 3:
+                    with st.expander("📅 查看星期分布"):
+                        fig_dow = build_dow_fig(tuple(DAY_NAMES[d] for d in seen_days), tuple(day_means))
+                        st.plotly_chart(fig_dow, use_container_width=True)
 
-                    st.divider()
-                # If user doesn't take medication, skip this section entirely
+            st.divider()
 
-                # 4. Gratitude Review Section
-                st.subheader("🌟 回顧感恩時刻 (Gratitude Journal)")
+            # 2. Tag Correlation Analysis - Enhanced with Protective Factors
+            st.subheader("🔍 What affects your mood?")
 
-                # Check if Gratitude column exists
-                if 'Gratitude' in df.columns:
-                    gratitude_df = df[df['Gratitude'].notna() & (df['Gratitude'] != "")].copy()
+            if not tag_stats.empty:
+                # Calculate overall average score for comparison
+                overall_avg = stats['overall_mean']
 
-                    if not gratitude_df.empty:
-                        # Show recent gratitude entries
-                        st.caption(f"過去 30 天的感恩紀錄 ({len(gratitude_df)} 則)")
+                # Separate based on tag category AND score comparison
+                stressors = tag_stats[tag_stats['Tags'].isin(NEGATIVE_TAGS)].sort_values(by='mean', ascending=False)
+                protective = tag_stats[tag_stats['Tags'].isin(POSITIVE_TAGS)].sort_values(by='mean', ascending=True)
 
-                        # Filter last 30 days
-                        recent_gratitude = gratitude_df[gratitude_df['Date'] > (datetime.now() - timedelta(days=30))].sort_values(by='Date', ascending=False)
+                # Display insights
+                col_stress, col_protect = st.columns(2)
 
-                        if not recent_gratitude.empty:
-                            for _, row in recent_gratitude.head(10).iterrows():
-                                date_str = row['Date'].strftime('%Y-%m-%d')
-                                gratitude_text = row['Gratitude']
+                with col_stress:
+                    st.metric("Overall Avg Score", f"{overall_avg:.1f}", help="Your average mood score across all entries")
 
-                                # Display each gratitude entry as a card
-                                st.markdown(f"**{date_str}**")
-
-                                # Split by separator and show each item
-                                items = gratitude_text.split(' | ')
-                                for item in items:
-                                    if item.strip():
-                                        st.markdown(f"- {item}")
-                                st.markdown("")  # Add spacing
+                with col_protect:
+                    if not protective.empty:
+                        best_factor = protective.iloc[0]['Tags']
+                        best_score = protective.iloc[0]['mean']
+                        improvement = overall_avg - best_score
+                        st.metric("Best Helper", f"{best_factor}", f"-{improvement:.1f}", delta_color="inverse", help="Tag with lowest avg score")
+
+                # Show stressors
+                if not stressors.empty:
+                    st.markdown("#### ⚠️ 壓力因素 (Stressors)")
+                    st.caption(f"這些標籤出現時，你的分數通常較高（平均 > {overall_avg:.1f}）")
+
+                    fig_stress = build_tag_bar_fig(tuple(stressors['Tags']), tuple(stressors['mean']),
+                                                   "Reds", 'total ascending')
+                    st.plotly_chart(fig_stress, use_container_width=True)
+
+                # Show protective factors
+                if not protective.empty:
+                    st.markdown("#### 💚 保護因素 (Protective Factors)")
+                    st.caption(f"這些標籤出現時，你的分數通常較低（平均 ≤ {overall_avg:.1f}）")
+
+                    # Reversed scale so darker = better
+                    fig_protect = build_tag_bar_fig(tuple(protective['Tags']), tuple(protective['mean']),
+                                                    "Greens_r", 'total descending')
+                    st.plotly_chart(fig_protect, use_container_width=True)
+
+                    # Actionable insight
+                    st.success(f"💡 **洞察**: 試著增加「{protective.iloc[0]['Tags']}」的頻率，這通常能幫助你感覺更好！")
+
+                # Show detail table (optional)
+                with st.expander("See detailed statistics"):
+                    st.dataframe(tag_stats.rename(columns={"mean": "Avg Score", "count": "Frequency"}), use_container_width=True)
+            else:
+                st.info("No tags recorded yet. Try adding tags to your entries!")
+
+            st.divider()
+
+            # 3. Medication Adherence Analysis - Only show if user takes medication
+            # Check session state to see if user takes medication
+            if st.session_state.get("takes_medication", False):
+                st.subheader("💊 用藥順從性分析 (Medication Adherence)")
+
+                # Check if Medication column exists
+                if 'Medication' in df.columns:
+                    # Last 30 days without N/A entries, counted in compute_insight_stats
+                    total_days = stats['med_total']
+
+                    if total_days > 0:
+                        # Calculate adherence rate
+                        days_taken = stats['med_yes_count']
+                        adherence_rate = (days_taken / total_days * 100) if total_days > 0 else 0
+
+                        # Display metrics
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.metric("30天服藥率", f"{adherence_rate:.0f}%")
+                        with col2:
+                            st.metric("已服藥天數", f"{days_taken}/{total_days}")
+                        with col3:
+                            missed_days = total_days - days_taken
+                            st.metric("漏服天數", f"{missed_days}")
+
+                        # Adherence color coding
+                        if adherence_rate >= 80:
+                            st.success("✅ 服藥順從性良好！持續保持。")
+                        elif adherence_rate >= 50:
+                            st.warning("⚠️ 服藥順從性中等。試著設定提醒來提高服藥率。")
                         else:
-                            st.info("最近 30 天沒有感恩紀錄，試著記錄一些正向的事物吧！")
+                            st.error("🚨 服藥順從性偏低。建議與醫師討論是否需要調整用藥計畫。")
+
+                        # Correlation: Medication vs Mood Score
+                        if stats['med_yes_count'] > 0 and stats['med_no_count'] > 0:
+                            avg_score_taken = stats['med_yes_sum'] / stats['med_yes_count']
+                            avg_score_missed = stats['med_no_sum'] / stats['med_no_count']
+                            score_diff = avg_score_missed - avg_score_taken
+
+                            st.markdown("#### 用藥對情緒的影響")
+                            col_a, col_b = st.columns(2)
+                            with col_a:
+                                st.metric("有服藥時平均分數", f"{avg_score_taken:.1f}")
+                            with col_b:
+                                st.metric("漏服藥時平均分數", f"{avg_score_missed:.1f}", f"+{score_diff:.1f}" if score_diff > 0 else f"{score_diff:.1f}")
+
+                            if score_diff > 1:
+                                st.info(f"💡 **洞察**: 漏服藥時，你的分數平均高 {score_diff:.1f} 分。規律服藥似乎對你的情緒有幫助。")
+                            elif score_diff < -1:
+                                st.info(f"💡 **洞察**: 有服藥時，你的分數平均高 {abs(score_diff):.1f} 分。建議與醫師討論藥物是否適合。")
+                            else:
+                                st.info("💡 用藥與情緒分數的關聯性不明顯，可能需要更多數據來分析。")
                     else:
-                        st.info("還沒有感恩紀錄。在「Check-in」頁面開始記錄吧！")
+                        st.info("最近 30 天沒有用藥紀錄。")
                 else:
-                    st.info("感恩功能已新增！下次記錄時就可以使用了。")
+                    st.info("用藥追蹤功能已新增！下次記錄時就可以使用了。")
 
+                st.divider()
+            # If user doesn't take medication, skip this section entirely
+
+            # 4. Gratitude Review Section
+            st.subheader("🌟 回顧感恩時刻 (Gratitude Journal)")
+
+            # Check if Gratitude column exists
+            if 'Gratitude' in df.columns:
+                gratitude_df = df[df['Gratitude'].notna() & (df['Gratitude'] != "")]
+
+                if not gratitude_df.empty:
+                    # Show recent gratitude entries
+                    st.caption(f"過去 30 天的感恩紀錄 ({len(gratitude_df)} 則)")
+
+                    # Filter last 30 days; df is already sorted by Date, so slice the newest 10
+                    # off the end instead of re-sorting the whole history
+                    recent_gratitude = gratitude_df[gratitude_df['Date'] > today - pd.Timedelta(days=30)].iloc[-10:].iloc[::-1]
+
+                    if not recent_gratitude.empty:
+                        # Format all dates in one vectorized call instead of a Series per row
+                        dates = recent_gratitude['Date'].dt.strftime('%Y-%m-%d').to_numpy()
+                        gratitudes = recent_gratitude['Gratitude'].to_numpy()
+                        # Collect every entry into one markdown block: one message to the frontend
+                        lines = []
+                        for date_str, gratitude_text in zip(dates, gratitudes):
+                            # Display each gratitude entry as a card
+                            lines.append(f"**{date_str}**")
+
+                            # Split by separator and show each item
+                            items = gratitude_text.split(' | ')
+                            for item in items:
+                                if item.strip():
+                                    lines.append(f"- {item}")
+                            lines.append("")  # Add spacing
+                        st.markdown("\n".join(lines))
+                    else:
+                        st.info("最近 30 天沒有感恩紀錄，試著記錄一些正向的事物吧！")
+                else:
+                    st.info("還沒有感恩紀錄。在「Check-in」頁面開始記錄吧！")
             else:
-                st.info("No data available for this user.")
+                st.info("感恩功能已新增！下次記錄時就可以使用了。")
+
         else:
-            st.info("Database is empty.")
+            st.info("No data available for this user.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
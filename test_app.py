@@ -0,0 +1,284 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+USER = "me@example.com"
+
+
+class SessionState(dict):
+    # Attribute access like st.session_state, without a running Streamlit session
+    __getattr__ = dict.__getitem__
+    __setattr__ = dict.__setitem__
+    __delattr__ = dict.__delitem__
+
+
+class FakeSheet:
+    def __init__(self, rows):
+        self.values = [list(app.SHEET_COLUMNS)] + rows
+        self.error = None
+        self.fetched = []
+
+    def col_values(self, col):
+        return [row[col - 1] for row in self.values]
+
+    def batch_get(self, ranges):
+        blocks = []
+        self.fetched.append(list(ranges))
+        for a1 in ranges:
+            first, last = map(int, re.findall(r"\d+", a1))
+            blocks.append(self.values[first - 1:last])
+        return blocks
+
+    def append_rows(self, rows, **kwargs):
+        if self.error: raise self.error
+        self.values.extend(rows)
+        n = len(self.values)
+        return {"updates": {"updatedRange": f"Sheet1!A{n - len(rows) + 1}:G{n}"}}
+
+
+def entry(day, score=5):
+    return [USER, f"2026-01-{day:02d}", score, "", "", "", "N/A"]
+
+
+@pytest.fixture
+def env(monkeypatch):
+    clock = [1000.0]
+    cache = {}
+    errors = []
+    executor = ThreadPoolExecutor(max_workers=1)
+    sheet = FakeSheet([entry(day) for day in range(1, 6)])
+    fetch = app.fetch_user_rows.__wrapped__
+
+    def fetch_user_rows(_sheet, user_email):
+        # Stands in for the st.cache_data entry: refetched once RECORDS_TTL has passed
+        hit = cache.get(user_email)
+        if hit is None or clock[0] - hit[0] >= app.RECORDS_TTL:
+            hit = cache[user_email] = (clock[0], fetch(_sheet, user_email))
+        return hit[1].copy()
+
+    monkeypatch.setattr(app.st, "session_state", SessionState())
+    monkeypatch.setattr(app.st, "error", lambda message: errors.append(message))
+    monkeypatch.setattr(app.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(app, "fetch_user_rows", fetch_user_rows)
+    monkeypatch.setattr(app, "get_write_executor", lambda: executor)
+    yield sheet, clock, executor, errors
+    executor.shutdown()
+
+
+def save(sheet, executor, row):
+    app.save_pending_row(sheet, USER, row)
+    # Let the background append land before the next rerun
+    executor.submit(lambda: None).result()
+
+
+def test_saved_row_shows_before_the_cache_refreshes(env):
+    sheet, clock, executor, errors = env
+    assert len(app.load_user_frame(sheet, USER)) == 5
+    save(sheet, executor, entry(6))
+    assert len(app.load_user_frame(sheet, USER)) == 6
+    assert len(app.load_user_frame(sheet, USER)) == 6
+
+
+def test_save_idle_save_shows_both_rows(env):
+    sheet, clock, executor, errors = env
+    app.load_user_frame(sheet, USER)
+    save(sheet, executor, entry(6))
+    assert len(app.load_user_frame(sheet, USER)) == 6
+
+    # Idle past the records TTL: the refetch contains the first row and retires its batch
+    clock[0] += app.RECORDS_TTL + 1
+    assert len(app.load_user_frame(sheet, USER)) == 6
+    assert "pending_rows" not in app.st.session_state
+
+    save(sheet, executor, entry(7))
+    for _ in range(3):
+        df = app.load_user_frame(sheet, USER)
+        assert len(df) == len(sheet.values) - 1 == 7
+        assert df['Date'].max() == app.pd.Timestamp("2026-01-07")
+
+
+def test_other_device_save_does_not_retire_an_in_flight_row(env):
+    sheet, clock, executor, errors = env
+    app.load_user_frame(sheet, USER)
+    release = threading.Event()
+    executor.submit(release.wait)  # hold the writer so this session's append stays in flight
+    app.save_pending_row(sheet, USER, entry(6))
+
+    # The same user saves from another device, then the records cache refreshes
+    sheet.append_rows([entry(7)])
+    clock[0] += app.RECORDS_TTL + 1
+    df = app.load_user_frame(sheet, USER)
+    assert len(df) == 7
+    assert app.pd.Timestamp("2026-01-06") in set(df['Date'])
+
+    release.set()
+    executor.submit(lambda: None).result()
+    clock[0] += app.RECORDS_TTL + 1
+    assert len(app.load_user_frame(sheet, USER)) == len(sheet.values) - 1 == 7
+    assert "pending_rows" not in app.st.session_state
+
+
+def test_failed_write_is_reported_after_another_device_saves(env):
+    sheet, clock, executor, errors = env
+    app.load_user_frame(sheet, USER)
+    release = threading.Event()
+    executor.submit(release.wait)
+    app.save_pending_row(sheet, USER, entry(6))
+
+    sheet.append_rows([entry(7)])
+    clock[0] += app.RECORDS_TTL + 1
+    app.load_user_frame(sheet, USER)
+
+    sheet.error = RuntimeError("quota exceeded")
+    release.set()
+    executor.submit(lambda: None).result()
+    df = app.load_user_frame(sheet, USER)
+    assert len(errors) == 1 and "quota exceeded" in errors[0]
+    assert len(df) == 6
+    assert app.pd.Timestamp("2026-01-06") not in set(df['Date'])
+
+
+def test_tag_stats_follow_a_same_length_refetch(env):
+    sheet, clock, executor, errors = env
+    sheet.values[1][3] = "😴 沒睡好"
+    df = app.load_user_frame(sheet, USER)
+    assert list(app.get_cached_tag_stats(df)['Tags']) == ["😴 沒睡好"]
+
+    # The row is edited on the sheet: same row count, different tags
+    sheet.values[1][3] = "🏃 有運動"
+    clock[0] += app.RECORDS_TTL + 1
+    df = app.load_user_frame(sheet, USER)
+    assert list(app.get_cached_tag_stats(df)['Tags']) == ["🏃 有運動"]
+    assert app.get_cached_tag_stats(df) is app.get_cached_tag_stats(df)
+
+
+def test_each_session_gets_its_own_writer(monkeypatch):
+    executors = []
+    for _ in range(2):
+        monkeypatch.setattr(app.st, "session_state", SessionState())
+        executors.append(app.get_write_executor())
+        assert app.get_write_executor() is executors[-1]
+    assert executors[0] is not executors[1]
+    for executor in executors:
+        executor.shutdown()
+
+
+def test_scattered_rows_are_fetched_in_groups_of_ranges(monkeypatch):
+    monkeypatch.setattr(app, "MAX_FETCH_RANGES", 2)
+    other = ["other@example.com", "2026-01-01", 20, "", "secret", "", "N/A"]
+    # This user's rows interleave with another user's: every entry is its own range
+    sheet = FakeSheet([row for day in range(1, 6) for row in (entry(day, score=day), list(other))])
+    df = app.fetch_user_rows.__wrapped__(sheet, USER)
+
+    assert len(sheet.fetched) == 3
+    assert all(len(ranges) <= 3 for ranges in sheet.fetched)
+    assert "A1:G1" in sheet.fetched[0]
+    assert list(df['Row']) == [2, 4, 6, 8, 10]
+    assert list(df['Score']) == [1, 2, 3, 4, 5]
+    assert set(df['User_Email']) == {USER}
+
+
+@pytest.fixture
+def id_tokens(monkeypatch):
+    serialization = pytest.importorskip("cryptography.hazmat.primitives.serialization")
+    rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+    from google.auth import crypt, jwt
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode()
+    public_pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                               serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    signer = crypt.RSASigner.from_string(private_pem, key_id="current")
+
+    class FakeCerts:
+        # Stands in for the cached fetch_google_certs: serves `certs` until cleared
+        def __init__(self):
+            self.certs, self.fetches = {"current": public_pem}, 0
+            self.cached = None
+
+        def __call__(self):
+            if self.cached is None:
+                self.fetches += 1
+                self.cached = dict(self.certs)
+            return self.cached
+
+        def clear(self):
+            self.cached = None
+
+    certs = FakeCerts()
+    monkeypatch.setattr(app, "fetch_google_certs", certs)
+    monkeypatch.setattr(app, "get_oauth_config", lambda: {"web": {"client_id": "client-id"}})
+
+    def make(**claims):
+        now = int(app.time.time())
+        payload = {"iss": "https://accounts.google.com", "aud": "client-id", "iat": now, "exp": now + 3600,
+                   "email": USER, "email_verified": True}
+        payload.update(claims)
+        return SimpleNamespace(id_token=jwt.encode(signer, payload).decode())
+
+    return make, certs
+
+
+def test_id_token_email_is_returned(id_tokens):
+    make, certs = id_tokens
+    # Issued slightly "in the future" by a clock ahead of ours: within the allowed skew
+    assert app.fetch_user_email(make(iat=int(app.time.time()) + 30)) == USER
+
+
+@pytest.mark.parametrize("claims, message", [
+    ({"iss": "https://evil.example.com"}, "issuer"),
+    ({"email_verified": False}, "not verified"),
+    ({"aud": "another-client"}, "audience"),
+])
+def test_id_token_is_rejected(id_tokens, claims, message):
+    make, certs = id_tokens
+    with pytest.raises(ValueError, match=message):
+        app.fetch_user_email(make(**claims))
+
+
+def test_unknown_kid_refetches_the_certs_once(id_tokens):
+    make, certs = id_tokens
+    certs.cached = {"retired": certs.certs["current"]}  # cached before Google rotated keys
+    assert app.fetch_user_email(make()) == USER
+    assert certs.fetches == 1 and "current" in certs.cached
+
+
+def test_certs_error_response_is_not_cached(monkeypatch):
+    class ErrorResponse:
+        def raise_for_status(self):
+            raise app.requests.HTTPError("503 Service Unavailable")
+
+        def json(self):
+            return {"error": "unavailable"}
+
+    class Session:
+        def get(self, url, timeout):
+            return ErrorResponse()
+
+    monkeypatch.setattr(app, "get_http_session", lambda: Session())
+    with pytest.raises(app.requests.HTTPError):
+        app.fetch_google_certs.__wrapped__()
+
+
+def test_frame_expires_with_the_records_it_was_built_from(env):
+    sheet, clock, executor, errors = env
+    app.load_user_frame(sheet, USER)  # records fetched at t=1000
+
+    clock[0] += 100
+    sheet.append_rows([entry(7)])  # saved from another device
+    clock[0] += 150
+    # A write landing at t=1250 rebuilds the frame from the same t=1000 records
+    save(sheet, executor, entry(6))
+    assert len(app.load_user_frame(sheet, USER)) == 6
+
+    # Past the records' TTL the frame must refetch, even though it was rebuilt only 51 s ago
+    clock[0] += 51
+    df = app.load_user_frame(sheet, USER)
+    assert len(df) == len(sheet.values) - 1 == 7
+    assert app.pd.Timestamp("2026-01-07") in set(df['Date'])